@@ -44,6 +44,8 @@ Write-Host ""
 Write-Host "============================================================" -ForegroundColor Green
 Write-Host "  STEP 3: Starting Flask API server (port 5001)..." -ForegroundColor Green
 Write-Host "============================================================" -ForegroundColor Green
+# gunicorn doesn't run on Windows, so use the Flask dev server here
+$env:FLASK_DEV = "1"
 $apiJob = Start-Process python -ArgumentList "scripts/api_server.py" -PassThru -NoNewWindow
 Start-Sleep -Seconds 3
 
@@ -4,15 +4,28 @@ Step 4 (Backend): Simple Flask API for MRR data
 Serves BigQuery MRR data as JSON for the React frontend.
 
 Usage:
-    pip install flask flask-cors google-cloud-bigquery python-dotenv
+    pip install flask flask-cors flask-caching flask-compress brotli redis google-cloud-bigquery pyarrow orjson python-dotenv
     export GOOGLE_APPLICATION_CREDENTIALS=path/to/service-account.json
     export GCP_PROJECT_ID=your-project-id
     export BQ_DATASET=mrr_dashboard
-    python scripts/api_server.py
+    export REDIS_URL=redis://localhost:6379/0   # optional, defaults to in-process cache
+
+    # Production (from the project root):
+    pip install gunicorn
+    gunicorn --workers 4 --threads 8 --worker-class gthread --timeout 60 \
+        --bind 0.0.0.0:5001 scripts.api_server:app
+
+    # Local development (Flask dev server, auto-reload):
+    FLASK_DEV=1 python scripts/api_server.py
 """
 
 import os
-from flask import Flask, jsonify
+import gzip
+import brotli
+import orjson
+from flask import Flask, jsonify, request
+from flask_caching import Cache
+from flask_compress import Compress
 from flask_cors import CORS
 from google.cloud import bigquery
 from dotenv import load_dotenv
@@ -22,73 +35,80 @@ load_dotenv()
 app = Flask(__name__)
 CORS(app)  # Allow React dev server to call this API
 
+app.config["COMPRESS_ALGORITHM"] = ["br", "gzip"]
+app.config["COMPRESS_MIN_SIZE"] = 512
+Compress(app)  # Skips responses that already set Content-Encoding
+
 GCP_PROJECT = os.environ.get("GCP_PROJECT_ID")
 BQ_DATASET = os.environ.get("BQ_DATASET", "mrr_dashboard")
+REDIS_URL = os.environ.get("REDIS_URL")
+MRR_CACHE_TTL = int(os.environ.get("MRR_CACHE_TTL", 300))
+
+# MRR only changes when the ETL runs, so cache the encoded payloads instead
+# of issuing a BigQuery job on every dashboard load.
+cache = Cache(app, config={
+    "CACHE_TYPE": "RedisCache" if REDIS_URL else "SimpleCache",
+    "CACHE_REDIS_URL": REDIS_URL,
+    "CACHE_DEFAULT_TIMEOUT": MRR_CACHE_TTL,
+})
 
 bq_client = bigquery.Client(project=GCP_PROJECT)
 
+# Built once at import so every request sends byte-identical SQL, which
+# lets BigQuery answer repeats from its 24h query result cache.
+_MRR_SQL = f"""
+SELECT month, active_subscriptions, active_customers, mrr_amount
+FROM `{GCP_PROJECT}.{BQ_DATASET}.mrr_monthly`
+ORDER BY month
+"""
+_MRR_JOB_CONFIG = bigquery.QueryJobConfig(use_query_cache=True, use_legacy_sql=False)
+_MRR_CACHE_KEY = "mrr_payloads"
+
+
+def _build_mrr_payloads() -> dict[str, bytes]:
+    """Query the MRR roll-up and encode it once per cache fill."""
+    results = bq_client.query(_MRR_SQL, job_config=_MRR_JOB_CONFIG).result()
+    # Decode the result set column-wise via Arrow and encode with orjson
+    # rather than building each row dict by attribute access. The
+    # result is a handful of rows, so skip the Storage Read API client.
+    data = results.to_arrow(create_bqstorage_client=False).to_pylist()
+    body = orjson.dumps({"data": data, "status": "ok"})
+    # Pre-compress so cache hits don't pay compression CPU per request
+    return {"identity": body, "br": brotli.compress(body), "gzip": gzip.compress(body)}
+
+
+def _encoded_response(payloads: dict[str, bytes]):
+    """Serve the best pre-compressed payload the client accepts."""
+    encoding = "identity"
+    if len(payloads["identity"]) >= app.config["COMPRESS_MIN_SIZE"]:
+        encoding = next((enc for enc in app.config["COMPRESS_ALGORITHM"]
+                         if request.accept_encodings[enc] > 0), "identity")
+
+    response = app.response_class(payloads[encoding], mimetype="application/json")
+    if encoding != "identity":
+        response.headers["Content-Encoding"] = encoding
+    response.vary.add("Accept-Encoding")
+    return response
+
 
 @app.route("/api/mrr", methods=["GET"])
 def get_mrr():
     """Return monthly MRR data as JSON."""
-    query = f"""
-    WITH month_spine AS (
-        SELECT month_start
-        FROM UNNEST(
-            GENERATE_DATE_ARRAY(
-                DATE_TRUNC(
-                    (SELECT DATE(MIN(created_at)) FROM `{GCP_PROJECT}.{BQ_DATASET}.subscriptions`),
-                    MONTH
-                ),
-                DATE_TRUNC(CURRENT_DATE(), MONTH),
-                INTERVAL 1 MONTH
-            )
-        ) AS month_start
-    ),
-    subscription_windows AS (
-        SELECT
-            subscription_id,
-            customer_id,
-            DATE(created_at) AS start_date,
-            COALESCE(
-                DATE(ended_at),
-                CASE WHEN status = 'canceled' THEN DATE(canceled_at) END,
-                CASE WHEN cancel_at_period_end = TRUE THEN DATE(current_period_end) END
-            ) AS end_date,
-            CASE
-                WHEN plan_interval = 'year' THEN
-                    CAST(ROUND(plan_amount * quantity / (12.0 * COALESCE(plan_interval_count, 1))) AS INT64)
-                WHEN plan_interval = 'month' THEN
-                    CAST(ROUND(plan_amount * quantity / COALESCE(plan_interval_count, 1)) AS INT64)
-                ELSE CAST(plan_amount * quantity AS INT64)
-            END AS monthly_amount_cents
-        FROM `{GCP_PROJECT}.{BQ_DATASET}.subscriptions`
-        WHERE status IN ('active', 'past_due', 'canceled')
-    )
-    SELECT
-        FORMAT_DATE('%Y-%m', m.month_start) AS month,
-        COUNT(DISTINCT s.subscription_id) AS active_subscriptions,
-        COUNT(DISTINCT s.customer_id) AS active_customers,
-        ROUND(SUM(s.monthly_amount_cents) / 100.0, 2) AS mrr_amount
-    FROM month_spine m
-    CROSS JOIN subscription_windows s
-    WHERE s.start_date <= DATE_ADD(m.month_start, INTERVAL 1 MONTH)
-      AND (s.end_date IS NULL OR s.end_date >= m.month_start)
-    GROUP BY m.month_start
-    ORDER BY m.month_start
-    """
-
     try:
-        results = bq_client.query(query).result()
-        data = []
-        for row in results:
-            data.append({
-                "month": row.month,
-                "active_subscriptions": row.active_subscriptions,
-                "active_customers": row.active_customers,
-                "mrr_amount": float(row.mrr_amount),
-            })
-        return jsonify({"data": data, "status": "ok"})
+        # A cache outage (e.g. Redis down) should only cost a BigQuery query
+        try:
+            payloads = cache.get(_MRR_CACHE_KEY)
+        except Exception:
+            app.logger.exception("MRR cache read failed")
+            payloads = None
+
+        if payloads is None:
+            payloads = _build_mrr_payloads()
+            try:
+                cache.set(_MRR_CACHE_KEY, payloads, timeout=MRR_CACHE_TTL)
+            except Exception:
+                app.logger.exception("MRR cache write failed")
+        return _encoded_response(payloads)
 
     except Exception as e:
         return jsonify({"error": str(e), "status": "error"}), 500
@@ -100,6 +120,13 @@ def health():
 
 
 if __name__ == "__main__":
+    if not os.environ.get("FLASK_DEV"):
+        raise SystemExit(
+            "The Flask dev server is for local development only. Serve with:\n"
+            "  gunicorn --workers 4 --threads 8 --worker-class gthread --timeout 60 "
+            "--bind 0.0.0.0:5001 scripts.api_server:app\n"
+            "or set FLASK_DEV=1 to run the dev server."
+        )
     port = int(os.environ.get("API_PORT", 5001))
     print(f"MRR API server starting on http://localhost:{port}")
-    app.run(host="0.0.0.0", port=port, debug=True)
+    app.run(host="0.0.0.0", port=port, debug=True, threaded=True)
@@ -7,22 +7,40 @@ and loads into BigQuery tables.
 Compatible with Stripe Python SDK v14+ (attribute access changes).
 
 Usage:
-    pip install stripe google-cloud-bigquery python-dotenv
+    pip install stripe google-cloud-bigquery google-cloud-storage pyarrow orjson python-dotenv
     python scripts/etl_stripe_to_bq.py
+
+Set GCS_BUCKET to switch to ELT: raw Stripe JSON is staged in GCS and
+shaped into the subscriptions/invoices tables by BigQuery SQL instead of
+in Python.
 """
 
 import stripe
 import os
-import json
+import gzip
+import orjson
+import queue
+import tempfile
+import threading
+from collections.abc import Iterable, Iterator
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timezone
+from itertools import chain, islice
+import pyarrow as pa
+import pyarrow.parquet as pq
+from google.api_core.exceptions import NotFound
 from google.cloud import bigquery
+from google.cloud import storage
 from dotenv import load_dotenv
 
+from stripe_client import stripe_list_all
+
 load_dotenv()
 
 stripe.api_key = os.environ.get("STRIPE_SECRET_KEY")
 GCP_PROJECT = os.environ.get("GCP_PROJECT_ID")
 BQ_DATASET = os.environ.get("BQ_DATASET", "mrr_dashboard")
+GCS_BUCKET = os.environ.get("GCS_BUCKET")
 
 if not stripe.api_key:
     raise ValueError("STRIPE_SECRET_KEY is required")
@@ -30,6 +48,12 @@ if not GCP_PROJECT:
     raise ValueError("GCP_PROJECT_ID is required")
 
 bq_client = bigquery.Client(project=GCP_PROJECT)
+gcs_client = storage.Client(project=GCP_PROJECT) if GCS_BUCKET else None
+
+# Stripe calls are network-bound, so overlap them across threads.
+# stripe_list_all() keeps the combined request rate under Stripe's limit.
+EXTRACT_WORKERS = 16
+EXTRACT_QUEUE_SIZE = 1_000
 
 SUBSCRIPTIONS_SCHEMA = [
     bigquery.SchemaField("subscription_id", "STRING", mode="REQUIRED"),
@@ -55,6 +79,20 @@ SUBSCRIPTIONS_SCHEMA = [
     bigquery.SchemaField("extracted_at", "TIMESTAMP", mode="REQUIRED"),
 ]
 
+# Monthly partitions: the data spans months, so daily partitions would be tiny.
+# Prunes queries that filter on signup date; the MRR refresh still reads every
+# partition, since old subscriptions stay active into recent months.
+SUBSCRIPTIONS_PARTITIONING = bigquery.TimePartitioning(
+    type_=bigquery.TimePartitioningType.MONTH, field="created_at",
+)
+
+# Rewrites an unpartitioned table in place with the monthly partition spec
+PARTITION_TABLE_SQL = """
+CREATE OR REPLACE TABLE `{table}`
+PARTITION BY TIMESTAMP_TRUNC({field}, MONTH)
+AS SELECT * FROM `{table}`
+"""
+
 INVOICES_SCHEMA = [
     bigquery.SchemaField("invoice_id", "STRING", mode="REQUIRED"),
     bigquery.SchemaField("customer_id", "STRING", mode="REQUIRED"),
@@ -71,6 +109,228 @@ INVOICES_SCHEMA = [
     bigquery.SchemaField("extracted_at", "TIMESTAMP", mode="REQUIRED"),
 ]
 
+# Monthly MRR roll-up served by the API. Pre-aggregating here means the API
+# reads one row per month instead of recomputing MRR on every request.
+# Each counted subscription's active window and monthly amount:
+_SUBSCRIPTION_WINDOWS_SQL = f"""
+    SELECT
+        subscription_id,
+        customer_id,
+        DATE(created_at) AS start_date,
+        COALESCE(
+            DATE(ended_at),
+            CASE WHEN status = 'canceled' THEN DATE(canceled_at) END,
+            CASE WHEN cancel_at_period_end = TRUE THEN DATE(current_period_end) END
+        ) AS end_date,
+        CASE
+            WHEN plan_interval = 'year' THEN
+                CAST(ROUND(plan_amount * quantity / (12.0 * COALESCE(plan_interval_count, 1))) AS INT64)
+            WHEN plan_interval = 'month' THEN
+                CAST(ROUND(plan_amount * quantity / COALESCE(plan_interval_count, 1)) AS INT64)
+            ELSE CAST(plan_amount * quantity AS INT64)
+        END AS monthly_amount_cents
+    FROM `{GCP_PROJECT}.{BQ_DATASET}.subscriptions`
+    WHERE status IN ('active', 'past_due', 'canceled')
+"""
+
+# {month_floor} is the first month each subscription is expanded from, so the
+# same query serves both the full rebuild and the incremental MERGE.
+_MRR_MONTHLY_SELECT = f"""
+WITH subscription_windows AS ({_SUBSCRIPTION_WINDOWS_SQL})
+SELECT
+    FORMAT_DATE('%Y-%m', month_start) AS month,
+    APPROX_COUNT_DISTINCT(s.subscription_id) AS active_subscriptions,
+    APPROX_COUNT_DISTINCT(s.customer_id) AS active_customers,
+    ROUND(SUM(s.monthly_amount_cents) / 100.0, 2) AS mrr_amount
+FROM subscription_windows s,
+UNNEST(
+    -- One row per month the subscription was active, up to the current month
+    GENERATE_DATE_ARRAY(
+        {{month_floor}},
+        DATE_TRUNC(LEAST(COALESCE(s.end_date, CURRENT_DATE()), CURRENT_DATE()), MONTH),
+        INTERVAL 1 MONTH
+    )
+) AS month_start
+GROUP BY month_start
+"""
+
+# Full rebuild: first run, or when MRR_FULL_REFRESH is set.
+MRR_MONTHLY_SQL = f"""
+CREATE OR REPLACE TABLE `{GCP_PROJECT}.{BQ_DATASET}.mrr_monthly`
+CLUSTER BY month
+AS
+""" + _MRR_MONTHLY_SELECT.format(month_floor="DATE_TRUNC(s.start_date, MONTH)")
+
+# Incremental refresh: recompute only months >= @from_month and merge them in.
+MRR_MONTHLY_MERGE_SQL = f"""
+MERGE `{GCP_PROJECT}.{BQ_DATASET}.mrr_monthly` t
+USING (
+""" + _MRR_MONTHLY_SELECT.format(
+    month_floor="GREATEST(DATE_TRUNC(s.start_date, MONTH), @from_month)"
+) + """
+) s
+ON t.month = s.month
+WHEN MATCHED THEN UPDATE SET
+    active_subscriptions = s.active_subscriptions,
+    active_customers = s.active_customers,
+    mrr_amount = s.mrr_amount
+WHEN NOT MATCHED THEN
+    INSERT (month, active_subscriptions, active_customers, mrr_amount)
+    VALUES (s.month, s.active_subscriptions, s.active_customers, s.mrr_amount)
+WHEN NOT MATCHED BY SOURCE AND t.month >= FORMAT_DATE('%Y-%m', @from_month) THEN DELETE
+"""
+
+# The subscription windows the roll-up was last built from. Its creation
+# time doubles as the time of the last refresh.
+SAVE_MRR_SNAPSHOT_SQL = f"""
+CREATE TABLE `{GCP_PROJECT}.{BQ_DATASET}.mrr_snapshot` AS
+""" + _SUBSCRIPTION_WINDOWS_SQL
+
+# Dropped before the roll-up changes, so a run that fails part-way leaves no
+# snapshot behind and the next run rebuilds in full.
+DROP_MRR_SNAPSHOT_SQL = f"""
+DROP TABLE IF EXISTS `{GCP_PROJECT}.{BQ_DATASET}.mrr_snapshot`
+"""
+
+# Earliest month that can differ from the last refresh: the old or new start
+# month of every subscription window added, removed (including status
+# changes out of the counted set) or changed since the snapshot, plus every
+# month since the last run (active subscriptions roll into each new month
+# without changing).
+MRR_AFFECTED_FROM_SQL = f"""
+WITH subscription_windows AS ({_SUBSCRIPTION_WINDOWS_SQL})
+SELECT DATE_TRUNC(LEAST(
+    COALESCE(
+        MIN(LEAST(COALESCE(p.start_date, c.start_date), COALESCE(c.start_date, p.start_date))),
+        CURRENT_DATE()
+    ),
+    DATE(@last_run_at)
+), MONTH) AS from_month
+FROM `{GCP_PROJECT}.{BQ_DATASET}.mrr_snapshot` p
+FULL OUTER JOIN subscription_windows c
+    ON p.subscription_id = c.subscription_id
+WHERE p.subscription_id IS NULL
+    OR c.subscription_id IS NULL
+    OR p.customer_id IS DISTINCT FROM c.customer_id
+    OR p.start_date IS DISTINCT FROM c.start_date
+    OR p.end_date IS DISTINCT FROM c.end_date
+    OR p.monthly_amount_cents IS DISTINCT FROM c.monthly_amount_cents
+"""
+
+# Superseded by the mrr_monthly table; dropped so it stops refreshing.
+DROP_MRR_MONTHLY_MV_SQL = f"""
+DROP MATERIALIZED VIEW IF EXISTS `{GCP_PROJECT}.{BQ_DATASET}.mrr_monthly_mv`
+"""
+
+
+# ELT: external tables over the raw Stripe JSON staged in GCS. Only the
+# fields we use are declared; ignore_unknown_values skips the rest.
+RAW_EXTERNAL_TABLE_SQL = {
+    "subscriptions": f"""
+CREATE OR REPLACE EXTERNAL TABLE `{GCP_PROJECT}.{BQ_DATASET}.stripe_raw_subscriptions` (
+    id STRING,
+    status STRING,
+    currency STRING,
+    created INT64,
+    current_period_start INT64,
+    current_period_end INT64,
+    canceled_at INT64,
+    cancel_at_period_end BOOL,
+    ended_at INT64,
+    trial_start INT64,
+    trial_end INT64,
+    customer STRUCT<id STRING, email STRING, name STRING>,
+    items STRUCT<data ARRAY<STRUCT<
+        quantity INT64,
+        price STRUCT<
+            id STRING,
+            product STRING,
+            unit_amount INT64,
+            recurring STRUCT<`interval` STRING, interval_count INT64>
+        >
+    >>>
+)
+OPTIONS (
+    format = 'NEWLINE_DELIMITED_JSON',
+    compression = 'GZIP',
+    ignore_unknown_values = true,
+    uris = ['{{uri}}']
+)
+""",
+    "invoices": f"""
+CREATE OR REPLACE EXTERNAL TABLE `{GCP_PROJECT}.{BQ_DATASET}.stripe_raw_invoices` (
+    id STRING,
+    customer STRING,
+    subscription STRING,
+    status STRING,
+    amount_due INT64,
+    amount_paid INT64,
+    currency STRING,
+    period_start INT64,
+    period_end INT64,
+    created INT64,
+    status_transitions STRUCT<paid_at INT64>,
+    hosted_invoice_url STRING
+)
+OPTIONS (
+    format = 'NEWLINE_DELIMITED_JSON',
+    compression = 'GZIP',
+    ignore_unknown_values = true,
+    uris = ['{{uri}}']
+)
+""",
+}
+
+# ELT: shape the raw tables into the same columns the Python extract produces.
+TRANSFORM_SQL = {
+    "subscriptions": f"""
+CREATE OR REPLACE TABLE `{GCP_PROJECT}.{BQ_DATASET}.subscriptions`
+PARTITION BY TIMESTAMP_TRUNC(created_at, MONTH)
+AS
+SELECT
+    id AS subscription_id,
+    customer.id AS customer_id,
+    customer.email AS customer_email,
+    customer.name AS customer_name,
+    status,
+    items.data[SAFE_OFFSET(0)].price.id AS price_id,
+    items.data[SAFE_OFFSET(0)].price.product AS product_id,
+    items.data[SAFE_OFFSET(0)].price.unit_amount AS plan_amount,
+    items.data[SAFE_OFFSET(0)].price.recurring.`interval` AS plan_interval,
+    items.data[SAFE_OFFSET(0)].price.recurring.interval_count AS plan_interval_count,
+    currency,
+    COALESCE(items.data[SAFE_OFFSET(0)].quantity, 1) AS quantity,
+    TIMESTAMP_SECONDS(created) AS created_at,
+    TIMESTAMP_SECONDS(current_period_start) AS current_period_start,
+    TIMESTAMP_SECONDS(current_period_end) AS current_period_end,
+    TIMESTAMP_SECONDS(canceled_at) AS canceled_at,
+    COALESCE(cancel_at_period_end, FALSE) AS cancel_at_period_end,
+    TIMESTAMP_SECONDS(ended_at) AS ended_at,
+    TIMESTAMP_SECONDS(trial_start) AS trial_start,
+    TIMESTAMP_SECONDS(trial_end) AS trial_end,
+    CURRENT_TIMESTAMP() AS extracted_at
+FROM `{GCP_PROJECT}.{BQ_DATASET}.stripe_raw_subscriptions`
+""",
+    "invoices": f"""
+CREATE OR REPLACE TABLE `{GCP_PROJECT}.{BQ_DATASET}.invoices` AS
+SELECT
+    id AS invoice_id,
+    customer AS customer_id,
+    subscription AS subscription_id,
+    status,
+    amount_due,
+    amount_paid,
+    currency,
+    TIMESTAMP_SECONDS(period_start) AS period_start,
+    TIMESTAMP_SECONDS(period_end) AS period_end,
+    TIMESTAMP_SECONDS(created) AS created_at,
+    TIMESTAMP_SECONDS(status_transitions.paid_at) AS paid_at,
+    hosted_invoice_url,
+    CURRENT_TIMESTAMP() AS extracted_at
+FROM `{GCP_PROJECT}.{BQ_DATASET}.stripe_raw_invoices`
+""",
+}
+
 
 def ensure_dataset_and_tables():
     dataset_ref = bigquery.DatasetReference(GCP_PROJECT, BQ_DATASET)
@@ -82,21 +342,39 @@ def ensure_dataset_and_tables():
     except Exception as e:
         print(f"Dataset creation error: {e}")
 
-    for table_name, schema in [("subscriptions", SUBSCRIPTIONS_SCHEMA),
-                                ("invoices", INVOICES_SCHEMA)]:
+    for table_name, schema, partitioning in [
+        ("subscriptions", SUBSCRIPTIONS_SCHEMA, SUBSCRIPTIONS_PARTITIONING),
+        ("invoices", INVOICES_SCHEMA, None),
+    ]:
         table_ref = dataset_ref.table(table_name)
         table = bigquery.Table(table_ref, schema=schema)
+        table.time_partitioning = partitioning
         table = bq_client.create_table(table, exists_ok=True)
+        if partitioning and table.time_partitioning is None:
+            # Created before partitioning was added. Rewrite it in place so
+            # the existing rows survive if this run's extract comes back empty.
+            print(f"Migrating '{BQ_DATASET}.{table_name}' to a partitioned table...")
+            bq_client.query(PARTITION_TABLE_SQL.format(
+                table=f"{GCP_PROJECT}.{BQ_DATASET}.{table_name}",
+                field=partitioning.field,
+            )).result()
         print(f"Table '{BQ_DATASET}.{table_name}' is ready.")
 
 
+def drop_mrr_materialized_view():
+    try:
+        bq_client.query(DROP_MRR_MONTHLY_MV_SQL).result()
+    except Exception as e:
+        print(f"Materialized view cleanup error: {e}")
+
+
 def load_manifest() -> dict | None:
     manifest_path = "scripts/data_manifest.json"
     if not os.path.exists(manifest_path):
         print(f"  WARNING: {manifest_path} not found")
         return None
-    with open(manifest_path) as f:
-        return json.load(f)
+    with open(manifest_path, "rb") as f:
+        return orjson.loads(f.read())
 
 
 def _ts_to_iso(ts) -> str | None:
@@ -107,213 +385,371 @@ def _ts_to_iso(ts) -> str | None:
     return datetime.fromtimestamp(ts, tz=timezone.utc).isoformat()
 
 
-def _safe_get(obj, key, default=None):
-    """Safely get an attribute from a Stripe object, handling v14+ changes."""
-    # Try attribute access
-    try:
-        val = getattr(obj, key, None)
-        if val is not None:
-            return val
-    except Exception:
-        pass
-
-    # Try dict-style access
-    try:
-        val = obj.get(key, None)
-        if val is not None:
-            return val
-    except Exception:
-        pass
-
-    # Try bracket access
-    try:
-        val = obj[key]
-        if val is not None:
-            return val
-    except (KeyError, TypeError, IndexError):
-        pass
-
-    return default
-
-
 # ---------------------------------------------------------------------------
 # Extract subscriptions
 # ---------------------------------------------------------------------------
-def extract_subscriptions_via_manifest(manifest: dict) -> list[dict]:
-    """Fetch each subscription directly by ID, with safe attribute access."""
-    print("Extracting subscriptions by ID from manifest...")
-    subscriptions = []
-    now = datetime.now(timezone.utc).isoformat()
+def _subscription_to_row(sub, now: str) -> dict:
+    """Shape a subscription (with customer and price expanded) into a row."""
+    # Materialize each Stripe object as a plain dict once, then use dict lookups
+    sub_dict = dict(sub)
+    cust = dict(sub_dict.get("customer") or {})
+
+    # Get subscription item and price
+    items = dict(sub_dict.get("items") or {})
+    item_list = items.get("data") or []
+    item = dict(item_list[0]) if item_list else {}
+    price = dict(item.get("price") or {})
+    recurring = dict(price.get("recurring") or {})
+
+    # Stripe can send explicit nulls; default them to 1 like the ELT path does
+    quantity = item.get("quantity")
+    interval_count = recurring.get("interval_count")
+
+    return {
+        "subscription_id": sub_dict.get("id"),
+        "customer_id": cust.get("id"),
+        "customer_email": cust.get("email"),
+        "customer_name": cust.get("name"),
+        "status": sub_dict.get("status"),
+        "price_id": price.get("id"),
+        "product_id": price.get("product"),
+        "plan_amount": price.get("unit_amount"),
+        "plan_interval": recurring.get("interval"),
+        "plan_interval_count": (1 if interval_count is None else interval_count) if recurring else None,
+        "currency": sub_dict.get("currency"),
+        "quantity": 1 if quantity is None else quantity,
+        "created_at": _ts_to_iso(sub_dict.get("created")),
+        "current_period_start": _ts_to_iso(sub_dict.get("current_period_start")),
+        "current_period_end": _ts_to_iso(sub_dict.get("current_period_end")),
+        "canceled_at": _ts_to_iso(sub_dict.get("canceled_at")),
+        "cancel_at_period_end": sub_dict.get("cancel_at_period_end", False),
+        "ended_at": _ts_to_iso(sub_dict.get("ended_at")),
+        "trial_start": _ts_to_iso(sub_dict.get("trial_start")),
+        "trial_end": _ts_to_iso(sub_dict.get("trial_end")),
+        "extracted_at": now,
+    }
+
+
+_CLOCK_DONE = object()
+
+
+def _put(out: queue.Queue, item, stop: threading.Event) -> bool:
+    """Block until `item` is queued, giving up once the consumer has stopped."""
+    while not stop.is_set():
+        try:
+            out.put(item, timeout=0.5)
+            return True
+        except queue.Full:
+            continue
+    return False
 
-    # First, let's inspect one subscription to see its actual structure
-    test_sub_id = manifest["customers"][0]["subscription_id"]
-    print(f"\n  Inspecting subscription structure ({test_sub_id})...")
+
+def _stream_clock_subscriptions(clock_id: str, out: queue.Queue, stop: threading.Event):
+    """Queue every subscription on one test clock, customer and price inlined."""
     try:
-        test_sub = stripe.Subscription.retrieve(test_sub_id)
-        # Print all available keys
-        sub_dict = dict(test_sub)
-        print(f"  Available keys: {list(sub_dict.keys())}")
+        # Stripe omits test-clock subscriptions from list calls unless
+        # test_clock (or customer) is given, and omits canceled ones
+        # unless status="all".
+        for sub in stripe_list_all(
+            stripe.Subscription.list,
+            test_clock=clock_id,
+            status="all",
+            limit=100,
+            expand=["data.customer", "data.items.data.price"],
+        ):
+            if not _put(out, sub, stop):
+                return
     except Exception as e:
-        print(f"  Inspect error: {e}")
-
-    for entry in manifest["customers"]:
-        sub_id = entry["subscription_id"]
-        cust_id = entry["customer_id"]
-
+        # Hand the failure to the consumer: loading without this clock's
+        # subscriptions would truncate them out of the table.
+        print(f"  ERROR clock {clock_id}: {type(e).__name__}: {e}")
+        _put(out, e, stop)
+    finally:
+        _put(out, _CLOCK_DONE, stop)
+
+
+def iter_manifest_subscriptions(manifest: dict) -> Iterator:
+    """Yield the raw Stripe subscriptions listed in the manifest as they arrive."""
+    manifest_sub_ids = {entry["subscription_id"] for entry in manifest["customers"]}
+    clock_ids = manifest["clock_ids"]
+    found = 0
+
+    # Workers page through their clocks and hand subscriptions over through
+    # a bounded queue, so at most EXTRACT_QUEUE_SIZE are held at once.
+    out = queue.Queue(maxsize=EXTRACT_QUEUE_SIZE)
+    stop = threading.Event()
+    with ThreadPoolExecutor(max_workers=EXTRACT_WORKERS) as executor:
+        for clock_id in clock_ids:
+            executor.submit(_stream_clock_subscriptions, clock_id, out, stop)
         try:
-            sub = stripe.Subscription.retrieve(sub_id)
-            cust = stripe.Customer.retrieve(cust_id)
-
-            # Convert to dict for safe access
-            sub_dict = dict(sub)
-
-            # Get subscription item and price
-            items_data = sub_dict.get("items", {})
-            if hasattr(items_data, "data"):
-                item_list = items_data.data
-            elif isinstance(items_data, dict):
-                item_list = items_data.get("data", [])
-            else:
-                item_list = []
-
-            item = item_list[0] if item_list else None
-            price = None
-            plan_amount = None
-            plan_interval = None
-            plan_interval_count = None
-            price_id = None
-            product_id = None
-            quantity = 1
-
-            if item:
-                item_dict = dict(item) if hasattr(item, '__iter__') else {}
-                price = _safe_get(item, "price")
-                quantity = _safe_get(item, "quantity", 1)
-
-                if price:
-                    price_id = _safe_get(price, "id")
-                    product_id = _safe_get(price, "product")
-                    plan_amount = _safe_get(price, "unit_amount")
-                    recurring = _safe_get(price, "recurring")
-                    if recurring:
-                        plan_interval = _safe_get(recurring, "interval")
-                        plan_interval_count = _safe_get(recurring, "interval_count", 1)
-
-            row = {
-                "subscription_id": sub_dict.get("id", sub_id),
-                "customer_id": cust.id,
-                "customer_email": _safe_get(cust, "email"),
-                "customer_name": _safe_get(cust, "name"),
-                "status": sub_dict.get("status"),
-                "price_id": price_id,
-                "product_id": product_id,
-                "plan_amount": plan_amount,
-                "plan_interval": plan_interval,
-                "plan_interval_count": plan_interval_count,
-                "currency": sub_dict.get("currency"),
-                "quantity": quantity,
-                "created_at": _ts_to_iso(sub_dict.get("created")),
-                "current_period_start": _ts_to_iso(sub_dict.get("current_period_start")),
-                "current_period_end": _ts_to_iso(sub_dict.get("current_period_end")),
-                "canceled_at": _ts_to_iso(sub_dict.get("canceled_at")),
-                "cancel_at_period_end": sub_dict.get("cancel_at_period_end", False),
-                "ended_at": _ts_to_iso(sub_dict.get("ended_at")),
-                "trial_start": _ts_to_iso(sub_dict.get("trial_start")),
-                "trial_end": _ts_to_iso(sub_dict.get("trial_end")),
-                "extracted_at": now,
-            }
-            subscriptions.append(row)
-            print(f"  OK: {sub_id} status={sub_dict.get('status')} ({_safe_get(cust, 'name')})")
+            pending = len(clock_ids)
+            while pending:
+                sub = out.get()
+                if sub is _CLOCK_DONE:
+                    pending -= 1
+                elif isinstance(sub, Exception):
+                    raise sub
+                elif sub.id in manifest_sub_ids:
+                    found += 1
+                    yield sub
+        finally:
+            # Unblock workers if the consumer stopped early
+            stop.set()
+
+    missing = len(manifest_sub_ids) - found
+    if missing:
+        print(f"  WARNING: {missing} manifest subscriptions not found in Stripe")
+
+
+def extract_subscriptions_via_manifest(manifest: dict) -> Iterator[dict]:
+    """List subscriptions per test clock and yield rows for those in the manifest."""
+    print("Extracting subscriptions by test clock from manifest...")
+    count = 0
+    now = datetime.now(timezone.utc).isoformat()
 
+    for sub in iter_manifest_subscriptions(manifest):
+        try:
+            row = _subscription_to_row(sub, now)
+            print(f"  OK: {row['subscription_id']} status={row['status']} ({row['customer_name']})")
         except Exception as e:
-            print(f"  ERROR {sub_id}: {type(e).__name__}: {e}")
+            print(f"  ERROR {sub.id}: {type(e).__name__}: {e}")
+            continue
+        count += 1
+        yield row
 
-    print(f"\n  Extracted {len(subscriptions)} subscriptions")
-    return subscriptions
+    print(f"\n  Extracted {count} subscriptions")
 
 
 # ---------------------------------------------------------------------------
 # Extract invoices
 # ---------------------------------------------------------------------------
-def extract_invoices_via_manifest(manifest: dict) -> list[dict]:
-    """Fetch invoices for each customer in the manifest."""
-    print("\nExtracting invoices by customer from manifest...")
-    invoices = []
+def _invoice_to_row(inv, now: str) -> dict:
+    inv_dict = dict(inv)
+
+    # Safe access for status_transitions
+    paid_at = None
+    st = inv_dict.get("status_transitions")
+    if st:
+        if hasattr(st, "paid_at"):
+            paid_at = st.paid_at
+        elif isinstance(st, dict):
+            paid_at = st.get("paid_at")
+
+    return {
+        "invoice_id": inv_dict.get("id"),
+        "customer_id": inv_dict.get("customer"),
+        "subscription_id": inv_dict.get("subscription"),
+        "status": inv_dict.get("status"),
+        "amount_due": inv_dict.get("amount_due"),
+        "amount_paid": inv_dict.get("amount_paid"),
+        "currency": inv_dict.get("currency"),
+        "period_start": _ts_to_iso(inv_dict.get("period_start")),
+        "period_end": _ts_to_iso(inv_dict.get("period_end")),
+        "created_at": _ts_to_iso(inv_dict.get("created")),
+        "paid_at": _ts_to_iso(paid_at),
+        "hosted_invoice_url": inv_dict.get("hosted_invoice_url"),
+        "extracted_at": now,
+    }
+
+
+START_TS_MARGIN_SECS = 24 * 60 * 60
+
+
+def iter_manifest_invoices(manifest: dict) -> Iterator:
+    """Page through invoices since the simulation start, keeping manifest customers."""
+    manifest_cust_ids = {entry["customer_id"] for entry in manifest["customers"]}
+
+    if "start_ts" in manifest:
+        start_ts = manifest["start_ts"]
+    else:
+        # Older manifests only have start_date, a naive timestamp whose epoch
+        # depends on the generating machine's time zone; widen the bound by
+        # a day so the first month's invoices aren't cut off.
+        start = datetime.fromisoformat(manifest["start_date"]).replace(tzinfo=timezone.utc)
+        start_ts = int(start.timestamp()) - START_TS_MARGIN_SECS
+
+    # Errors propagate: a partial invoice list must not replace the table
+    for inv in stripe_list_all(stripe.Invoice.list, limit=100, created={"gte": start_ts}):
+        if inv.customer in manifest_cust_ids:
+            yield inv
+
+
+def extract_invoices_via_manifest(manifest: dict) -> Iterator[dict]:
+    """Yield invoice rows for the customers in the manifest."""
+    print("\nExtracting invoices created since the manifest start date...")
+    count = 0
     now = datetime.now(timezone.utc).isoformat()
-    seen_ids = set()
 
-    # Inspect one invoice first
-    test_cust_id = manifest["customers"][0]["customer_id"]
-    print(f"  Inspecting invoice structure for {test_cust_id}...")
-    try:
-        test_invs = stripe.Invoice.list(customer=test_cust_id, limit=1)
-        if test_invs.data:
-            inv_dict = dict(test_invs.data[0])
-            print(f"  Available keys: {list(inv_dict.keys())}")
-    except Exception as e:
-        print(f"  Inspect error: {e}")
+    for inv in iter_manifest_invoices(manifest):
+        count += 1
+        yield _invoice_to_row(inv, now)
 
-    for entry in manifest["customers"]:
-        cust_id = entry["customer_id"]
-        try:
-            result = stripe.Invoice.list(customer=cust_id, limit=100)
-            for inv in result.data:
-                inv_dict = dict(inv)
-
-                if inv_dict.get("id") in seen_ids:
-                    continue
-                seen_ids.add(inv_dict.get("id"))
-
-                # Safe access for status_transitions
-                paid_at = None
-                st = inv_dict.get("status_transitions")
-                if st:
-                    if hasattr(st, "paid_at"):
-                        paid_at = st.paid_at
-                    elif isinstance(st, dict):
-                        paid_at = st.get("paid_at")
-
-                row = {
-                    "invoice_id": inv_dict.get("id"),
-                    "customer_id": inv_dict.get("customer"),
-                    "subscription_id": inv_dict.get("subscription"),
-                    "status": inv_dict.get("status"),
-                    "amount_due": inv_dict.get("amount_due"),
-                    "amount_paid": inv_dict.get("amount_paid"),
-                    "currency": inv_dict.get("currency"),
-                    "period_start": _ts_to_iso(inv_dict.get("period_start")),
-                    "period_end": _ts_to_iso(inv_dict.get("period_end")),
-                    "created_at": _ts_to_iso(inv_dict.get("created")),
-                    "paid_at": _ts_to_iso(paid_at),
-                    "hosted_invoice_url": inv_dict.get("hosted_invoice_url"),
-                    "extracted_at": now,
-                }
-                invoices.append(row)
-
-            if len(result.data) > 0:
-                print(f"  {cust_id}: {len(result.data)} invoices")
+    print(f"\n  Extracted {count} invoices")
 
-        except Exception as e:
-            print(f"  ERROR {cust_id}: {type(e).__name__}: {e}")
 
-    print(f"\n  Extracted {len(invoices)} invoices")
-    return invoices
+def save_extract(rows: Iterable[dict], path: str) -> Iterator[dict]:
+    """Write rows to a local newline-delimited JSON file as they stream past."""
+    with open(path, "wb") as f:
+        for row in rows:
+            f.write(orjson.dumps(row, default=str) + b"\n")
+            yield row
+
+
+def _counted(rows: Iterable[dict], counter: list) -> Iterator[dict]:
+    for row in rows:
+        counter[0] += 1
+        yield row
+
+
+_ARROW_TYPES = {
+    "STRING": pa.string(),
+    "INTEGER": pa.int64(),
+    "BOOLEAN": pa.bool_(),
+    "TIMESTAMP": pa.timestamp("us", tz="UTC"),
+}
+
+PARQUET_BATCH_ROWS = 10_000
 
 
-def load_to_bigquery(table_name: str, rows: list[dict], schema: list):
-    if not rows:
+def _arrow_schema_from_bq(schema: list) -> pa.Schema:
+    return pa.schema([
+        pa.field(f.name, _ARROW_TYPES[f.field_type], nullable=f.mode != "REQUIRED")
+        for f in schema
+    ])
+
+
+def _arrow_batch(rows: list[dict], schema: list, arrow_schema: pa.Schema) -> pa.RecordBatch:
+    """Build a column-oriented Arrow batch from row dicts."""
+    columns = []
+    for field in schema:
+        values = [row.get(field.name) for row in rows]
+        if field.field_type == "TIMESTAMP":
+            values = [datetime.fromisoformat(v) if isinstance(v, str) else v for v in values]
+        columns.append(values)
+    return pa.RecordBatch.from_arrays(
+        [pa.array(col, type=f.type) for col, f in zip(columns, arrow_schema)],
+        schema=arrow_schema,
+    )
+
+
+def _rows_to_parquet(rows: Iterable[dict], schema: list):
+    """Serialize rows to a snappy-compressed Parquet temp file, a batch at a time."""
+    arrow_schema = _arrow_schema_from_bq(schema)
+    buf = tempfile.TemporaryFile()
+    with pq.ParquetWriter(buf, arrow_schema, compression="snappy") as writer:
+        while batch := list(islice(rows, PARQUET_BATCH_ROWS)):
+            writer.write_batch(_arrow_batch(batch, schema, arrow_schema))
+    buf.seek(0)
+    return buf
+
+
+def load_to_bigquery(table_name: str, rows: Iterable[dict], schema: list,
+                     time_partitioning: bigquery.TimePartitioning | None = None) -> int:
+    """
+    Replace a BigQuery table with `rows` in one Parquet load job
+    (WRITE_TRUNCATE) and return how many were written.
+    """
+    rows = iter(rows)
+    first = next(rows, None)
+    if first is None:
         print(f"  No rows to load for {table_name}.")
-        return
+        return 0
+    rows = chain([first], rows)
 
     table_ref = f"{GCP_PROJECT}.{BQ_DATASET}.{table_name}"
+    loaded = [0]
+
+    # Parquet is columnar and compressed, so it is smaller on the wire
+    # and cheaper for BigQuery to parse than newline-delimited JSON.
+    # The table schema comes from the Arrow schema embedded in the file.
     job_config = bigquery.LoadJobConfig(
-        schema=schema,
         write_disposition=bigquery.WriteDisposition.WRITE_TRUNCATE,
-        source_format=bigquery.SourceFormat.NEWLINE_DELIMITED_JSON,
+        source_format=bigquery.SourceFormat.PARQUET,
+        time_partitioning=time_partitioning,
     )
-    job = bq_client.load_table_from_json(rows, table_ref, job_config=job_config)
-    job.result()
-    print(f"  Loaded {len(rows)} rows into {table_ref}.")
+    with _rows_to_parquet(_counted(rows, loaded), schema) as parquet:
+        job = bq_client.load_table_from_file(parquet, table_ref, job_config=job_config)
+        job.result()
+
+    print(f"  Loaded {loaded[0]} rows into {table_ref}.")
+    return loaded[0]
+
+
+def stage_raw_to_gcs(table_name: str, objects: Iterable) -> tuple[str, int]:
+    """Stream raw Stripe objects to a gzipped NDJSON file in GCS."""
+    date = datetime.now(timezone.utc).strftime("%Y-%m-%d")
+    blob_name = f"stripe/raw/{date}/{table_name}.json.gz"
+    blob = gcs_client.bucket(GCS_BUCKET).blob(blob_name)
+
+    count = 0
+    with blob.open("wb") as f, gzip.GzipFile(fileobj=f, mode="wb") as gz:
+        for obj in objects:
+            gz.write(orjson.dumps(obj.to_dict(), default=str) + b"\n")
+            count += 1
+
+    uri = f"gs://{GCS_BUCKET}/{blob_name}"
+    print(f"  Staged {count} raw {table_name} to {uri}")
+    return uri, count
+
+
+def load_raw_via_gcs(table_name: str, objects: Iterable) -> int:
+    """ELT: stage raw objects in GCS, then transform them into `table_name` in BigQuery."""
+    uri, count = stage_raw_to_gcs(table_name, objects)
+    if count == 0:
+        print(f"  No rows to load for {table_name}.")
+        return 0
+
+    bq_client.query(RAW_EXTERNAL_TABLE_SQL[table_name].format(uri=uri)).result()
+    bq_client.query(TRANSFORM_SQL[table_name]).result()
+    print(f"  Transformed {count} rows into {GCP_PROJECT}.{BQ_DATASET}.{table_name}.")
+    return count
+
+
+def rebuild_mrr_monthly():
+    """Rebuild the monthly MRR roll-up from the freshly loaded subscriptions."""
+    bq_client.query(MRR_MONTHLY_SQL).result()
+    print(f"  Rebuilt {GCP_PROJECT}.{BQ_DATASET}.mrr_monthly.")
+
+
+def _query_params(**params) -> bigquery.QueryJobConfig:
+    types = {str: "STRING", datetime: "TIMESTAMP"}
+    return bigquery.QueryJobConfig(query_parameters=[
+        bigquery.ScalarQueryParameter(name, types.get(type(value), "DATE"), value)
+        for name, value in params.items()
+    ])
+
+
+def refresh_mrr_monthly():
+    """
+    Bring the MRR roll-up up to date, recomputing only the months that can
+    have changed since the last run.
+
+    Changed months are found by diffing the subscriptions table against the
+    snapshot saved by the previous run. Falls back to a full rebuild when
+    there is no snapshot (first run, or a run that failed part-way), when
+    the roll-up is missing, or when MRR_FULL_REFRESH is set.
+    """
+    snapshot_ref = f"{GCP_PROJECT}.{BQ_DATASET}.mrr_snapshot"
+    try:
+        last_run_at = bq_client.get_table(snapshot_ref).created
+    except NotFound:
+        last_run_at = None
+
+    if last_run_at is None or os.environ.get("MRR_FULL_REFRESH"):
+        bq_client.query(DROP_MRR_SNAPSHOT_SQL).result()
+        rebuild_mrr_monthly()
+    else:
+        from_month = next(iter(bq_client.query(MRR_AFFECTED_FROM_SQL, job_config=_query_params(
+            last_run_at=last_run_at)).result())).from_month
+        bq_client.query(DROP_MRR_SNAPSHOT_SQL).result()
+        try:
+            bq_client.query(MRR_MONTHLY_MERGE_SQL, job_config=_query_params(
+                from_month=from_month)).result()
+            print(f"  Merged {GCP_PROJECT}.{BQ_DATASET}.mrr_monthly from {from_month:%Y-%m}.")
+        except NotFound:
+            rebuild_mrr_monthly()
+
+    bq_client.query(SAVE_MRR_SNAPSHOT_SQL).result()
 
 
 def main():
@@ -332,24 +768,33 @@ def main():
     print(f"Manifest: {manifest['num_customers']} customers, {len(manifest['clock_ids'])} clocks\n")
 
     ensure_dataset_and_tables()
-
-    subscriptions = extract_subscriptions_via_manifest(manifest)
-    invoices = extract_invoices_via_manifest(manifest)
-
-    os.makedirs("scripts/extracts", exist_ok=True)
-    with open("scripts/extracts/subscriptions.json", "w") as f:
-        json.dump(subscriptions, f, indent=2, default=str)
-    with open("scripts/extracts/invoices.json", "w") as f:
-        json.dump(invoices, f, indent=2, default=str)
-    print("  Local extracts saved to scripts/extracts/")
-
-    load_to_bigquery("subscriptions", subscriptions, SUBSCRIPTIONS_SCHEMA)
-    load_to_bigquery("invoices", invoices, INVOICES_SCHEMA)
+    drop_mrr_materialized_view()
+
+    if GCS_BUCKET:
+        # ELT: raw JSON goes to GCS and BigQuery does the type coercion
+        print("Staging raw Stripe objects in GCS (ELT mode)...")
+        num_subscriptions = load_raw_via_gcs("subscriptions", iter_manifest_subscriptions(manifest))
+        refresh_mrr_monthly()
+        num_invoices = load_raw_via_gcs("invoices", iter_manifest_invoices(manifest))
+    else:
+        # Rows stream from Stripe through the local extract file into a
+        # Parquet temp file, at most a queue or batch of rows in memory at once.
+        os.makedirs("scripts/extracts", exist_ok=True)
+        subscriptions = save_extract(extract_subscriptions_via_manifest(manifest),
+                                     "scripts/extracts/subscriptions.ndjson")
+        num_subscriptions = load_to_bigquery("subscriptions", subscriptions, SUBSCRIPTIONS_SCHEMA,
+                                             time_partitioning=SUBSCRIPTIONS_PARTITIONING)
+        refresh_mrr_monthly()
+
+        invoices = save_extract(extract_invoices_via_manifest(manifest),
+                                "scripts/extracts/invoices.ndjson")
+        num_invoices = load_to_bigquery("invoices", invoices, INVOICES_SCHEMA)
+        print("  Local extracts saved to scripts/extracts/")
 
     print(f"\n{'=' * 60}")
     print("ETL complete!")
-    print(f"  Subscriptions loaded: {len(subscriptions)}")
-    print(f"  Invoices loaded:      {len(invoices)}")
+    print(f"  Subscriptions loaded: {num_subscriptions}")
+    print(f"  Invoices loaded:      {num_invoices}")
     print(f"{'=' * 60}")
 
 
@@ -22,9 +22,12 @@ import os
 import time
 import random
 import json
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime, timedelta
 from dotenv import load_dotenv
 
+from stripe_client import stripe_call
+
 load_dotenv()
 
 stripe.api_key = os.environ.get("STRIPE_SECRET_KEY")
@@ -69,15 +72,18 @@ LAST_NAMES = [
 # ---------------------------------------------------------------------------
 
 def wait_for_clock_ready(clock_id: str, timeout: int = 180):
-    """Poll until a test clock's status is 'ready'."""
-    for _ in range(timeout // 3):
-        clock = stripe.test_helpers.TestClock.retrieve(clock_id)
+    """Poll until a test clock's status is 'ready', backing off between polls."""
+    deadline = time.monotonic() + timeout
+    delay = 0.5  # Fast first checks; small advances often finish quickly
+    while time.monotonic() < deadline:
+        clock = stripe_call(stripe.test_helpers.TestClock.retrieve, clock_id)
         if clock.status == "ready":
             return True
         if clock.status == "internal_failure":
             print(f"    WARN: Clock {clock_id} hit internal_failure, retrying...")
             return False
-        time.sleep(3)
+        time.sleep(min(delay, max(0.0, deadline - time.monotonic())))
+        delay = min(delay * 1.5, 5.0)
     print(f"    WARN: Clock {clock_id} timed out waiting for 'ready' status.")
     return False
 
@@ -92,8 +98,9 @@ def create_products_and_prices():
     prices = []
 
     for plan in PLAN_CONFIG:
-        product = stripe.Product.create(name=f"MRR Dashboard - {plan['name']}")
-        price = stripe.Price.create(
+        product = stripe_call(stripe.Product.create, name=f"MRR Dashboard - {plan['name']}")
+        price = stripe_call(
+            stripe.Price.create,
             product=product.id,
             unit_amount=plan["amount"],
             currency="usd",
@@ -125,7 +132,8 @@ def create_customer_on_clock(clock_id: str, prices: list, index: int):
     email = f"{first.lower()}.{last.lower()}.{index}@example.com"
 
     # 1. Create customer attached to the test clock
-    customer = stripe.Customer.create(
+    customer = stripe_call(
+        stripe.Customer.create,
         name=f"{first} {last}",
         email=email,
         test_clock=clock_id,
@@ -133,8 +141,9 @@ def create_customer_on_clock(clock_id: str, prices: list, index: int):
 
     # 2. Attach a test card as the default payment method
     #    (pm_card_visa is a reusable test PaymentMethod in test mode)
-    pm = stripe.PaymentMethod.attach("pm_card_visa", customer=customer.id)
-    stripe.Customer.modify(
+    pm = stripe_call(stripe.PaymentMethod.attach, "pm_card_visa", customer=customer.id)
+    stripe_call(
+        stripe.Customer.modify,
         customer.id,
         invoice_settings={"default_payment_method": pm.id},
     )
@@ -143,7 +152,8 @@ def create_customer_on_clock(clock_id: str, prices: list, index: int):
     chosen_price = random.choices(prices, weights=PLAN_WEIGHTS, k=1)[0]
 
     # 4. Create the subscription — charge_automatically with the attached card
-    subscription = stripe.Subscription.create(
+    subscription = stripe_call(
+        stripe.Subscription.create,
         customer=customer.id,
         items=[{"price": chosen_price["price_id"]}],
     )
@@ -162,6 +172,18 @@ def create_customer_on_clock(clock_id: str, prices: list, index: int):
     }
 
 
+def create_clock_customers(clock_idx: int, clock_id: str, prices: list) -> list:
+    """Create this clock's customers one after another (keeps per-clock order)."""
+    customers = []
+    for i in range(CUSTOMERS_PER_CLOCK):
+        global_idx = clock_idx * CUSTOMERS_PER_CLOCK + i
+        try:
+            customers.append(create_customer_on_clock(clock_id, prices, global_idx))
+        except Exception as e:
+            print(f"    ERROR creating customer #{global_idx + 1}: {e}")
+    return customers
+
+
 # ---------------------------------------------------------------------------
 # Step 3: Simulate Churn & Payment Failures
 # ---------------------------------------------------------------------------
@@ -180,7 +202,7 @@ def simulate_churn(customers_info: list, month: int):
     to_cancel = random.sample(active, min(num_churn, len(active)))
     for c in to_cancel:
         try:
-            stripe.Subscription.modify(c["subscription_id"], cancel_at_period_end=True)
+            stripe_call(stripe.Subscription.modify, c["subscription_id"], cancel_at_period_end=True)
             c["status"] = "canceling"
             print(f"    Canceling: {c['customer_id']} ({c['plan']})")
         except Exception as e:
@@ -192,8 +214,10 @@ def simulate_churn(customers_info: list, month: int):
     for c in to_fail:
         try:
             # Attach a card that always declines
-            pm = stripe.PaymentMethod.attach("pm_card_chargeDeclined", customer=c["customer_id"])
-            stripe.Customer.modify(
+            pm = stripe_call(stripe.PaymentMethod.attach, "pm_card_chargeDeclined",
+                             customer=c["customer_id"])
+            stripe_call(
+                stripe.Customer.modify,
                 c["customer_id"],
                 invoice_settings={"default_payment_method": pm.id},
             )
@@ -207,24 +231,30 @@ def simulate_churn(customers_info: list, month: int):
 # Step 4: Advance Clocks Month-by-Month
 # ---------------------------------------------------------------------------
 
+def advance_clock(clock_id: str, target_ts: int):
+    print(f"  Advancing clock {clock_id}...")
+    try:
+        stripe_call(stripe.test_helpers.TestClock.advance, clock_id, frozen_time=target_ts)
+    except stripe.error.InvalidRequestError as e:
+        print(f"    Advance error: {e}")
+
+
 def advance_all_clocks(clock_ids: list, target_ts: int):
     """Advance all clocks to a target timestamp, waiting for each to be ready."""
-    for clock_id in clock_ids:
-        print(f"  Advancing clock {clock_id}...")
-        try:
-            stripe.test_helpers.TestClock.advance(clock_id, frozen_time=target_ts)
-        except stripe.error.InvalidRequestError as e:
-            print(f"    Advance error: {e}")
-            continue
-
-    # Wait for all clocks to be ready before proceeding
-    print("  Waiting for clocks to finish advancing...")
-    for clock_id in clock_ids:
-        ready = wait_for_clock_ready(clock_id)
-        if ready:
-            print(f"    Clock {clock_id}: ready")
-        else:
-            print(f"    Clock {clock_id}: NOT ready (may need manual check)")
+    # Clocks are independent, so advance them all at once
+    with ThreadPoolExecutor(max_workers=len(clock_ids)) as executor:
+        list(executor.map(advance_clock, clock_ids, [target_ts] * len(clock_ids)))
+
+        # Wait for all clocks to be ready before proceeding
+        print("  Waiting for clocks to finish advancing...")
+        futures = {executor.submit(wait_for_clock_ready, clock_id): clock_id
+                   for clock_id in clock_ids}
+        for future in as_completed(futures):
+            clock_id = futures[future]
+            if future.result():
+                print(f"    Clock {clock_id}: ready")
+            else:
+                print(f"    Clock {clock_id}: NOT ready (may need manual check)")
 
 
 # ---------------------------------------------------------------------------
@@ -253,25 +283,27 @@ def main():
     print("\n--- Creating test clocks ---")
     clock_ids = []
     for i in range(NUM_TEST_CLOCKS):
-        clock = stripe.test_helpers.TestClock.create(
+        clock = stripe_call(
+            stripe.test_helpers.TestClock.create,
             frozen_time=start_ts,
             name=f"MRR-Sim-{i + 1}",
         )
         clock_ids.append(clock.id)
         print(f"  Clock {i + 1}: {clock.id}")
 
-    # 4. Create customers + subscriptions on each clock
+    # 4. Create customers + subscriptions on each clock, one thread per clock.
+    #    stripe_call() rate-limits across threads, so no manual sleeps needed.
+    print(f"\n--- Creating customers on {NUM_TEST_CLOCKS} clocks ---")
     all_customers = []
-    for clock_idx, clock_id in enumerate(clock_ids):
-        print(f"\n--- Clock {clock_idx + 1}/{NUM_TEST_CLOCKS}: Creating customers ---")
-        for i in range(CUSTOMERS_PER_CLOCK):
-            global_idx = clock_idx * CUSTOMERS_PER_CLOCK + i
-            try:
-                info = create_customer_on_clock(clock_id, prices, global_idx)
-                all_customers.append(info)
-            except Exception as e:
-                print(f"    ERROR creating customer #{global_idx + 1}: {e}")
-            time.sleep(0.3)  # Gentle rate limiting
+    with ThreadPoolExecutor(max_workers=NUM_TEST_CLOCKS) as executor:
+        per_clock = executor.map(
+            create_clock_customers,
+            range(NUM_TEST_CLOCKS),
+            clock_ids,
+            [prices] * NUM_TEST_CLOCKS,
+        )
+        for customers in per_clock:
+            all_customers.extend(customers)
 
     print(f"\nTotal customers created: {len(all_customers)}")
 
@@ -294,6 +326,7 @@ def main():
     manifest = {
         "generated_at": now.isoformat(),
         "start_date": start_time.isoformat(),
+        "start_ts": start_ts,  # The clocks' frozen_time; unambiguous unlike start_date
         "months_simulated": MONTHS_TO_SIMULATE,
         "num_customers": len(all_customers),
         "clock_ids": clock_ids,
@@ -0,0 +1,101 @@
+"""
+Shared Stripe API helpers
+=========================
+Client-side rate limiting and 429 retries for scripts that call Stripe
+from several threads at once.
+
+Stripe allows ~100 read/write requests per second in live mode and ~25 in
+test mode, so all threads share one token bucket sized from the API key
+(or STRIPE_MAX_RPS), and rate-limited calls are retried with exponential
+backoff.
+
+Usage:
+    from stripe_client import stripe_call, stripe_list_all
+    sub = stripe_call(stripe.Subscription.retrieve, sub_id)
+    for inv in stripe_list_all(stripe.Invoice.list, limit=100):
+        ...
+"""
+
+import os
+import random
+import threading
+import time
+
+import stripe
+
+LIVE_REQUESTS_PER_SEC = 80  # Headroom under Stripe's ~100 req/s live limit
+TEST_REQUESTS_PER_SEC = 20  # Headroom under Stripe's ~25 req/s test limit
+MAX_RETRIES = 5
+
+
+class TokenBucket:
+    """Thread-safe token bucket: at most `rate` acquisitions per second."""
+
+    def __init__(self, rate: float, capacity: float | None = None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+_bucket = None
+_bucket_lock = threading.Lock()
+
+
+def _max_requests_per_sec() -> float:
+    if os.environ.get("STRIPE_MAX_RPS"):
+        return float(os.environ["STRIPE_MAX_RPS"])
+    key = stripe.api_key or ""
+    return TEST_REQUESTS_PER_SEC if key.startswith(("sk_test_", "rk_test_")) else LIVE_REQUESTS_PER_SEC
+
+
+def _get_bucket() -> TokenBucket:
+    # Built on first use, after the caller has set stripe.api_key
+    global _bucket
+    with _bucket_lock:
+        if _bucket is None:
+            rate = _max_requests_per_sec()
+            # A quarter-second burst, so a thread pool starting at once can't
+            # spend a full second's allowance in one go
+            _bucket = TokenBucket(rate, capacity=max(1.0, rate / 4))
+        return _bucket
+
+
+def stripe_call(fn, *args, **kwargs):
+    """Call a Stripe API method under the shared rate limit, retrying 429s."""
+    for attempt in range(MAX_RETRIES + 1):
+        _get_bucket().acquire()
+        try:
+            return fn(*args, **kwargs)
+        except stripe.error.RateLimitError:
+            if attempt == MAX_RETRIES:
+                raise
+            # Exponential backoff with jitter so threads don't retry in lockstep
+            time.sleep(min(0.5 * 2 ** attempt, 8.0) + random.uniform(0, 0.5))
+
+
+def stripe_list_all(list_fn, **params):
+    """
+    Yield every object from a Stripe list call, fetching each page through
+    stripe_call(). Unlike auto_paging_iter(), later pages are rate-limited
+    and retried too.
+    """
+    while True:
+        page = stripe_call(list_fn, **params)
+        yield from page.data
+        if not page.has_more or not page.data:
+            return
+        params["starting_after"] = page.data[-1].id
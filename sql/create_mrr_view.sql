@@ -7,21 +7,7 @@
 
 CREATE OR REPLACE VIEW `{PROJECT}.{DATASET}.v_monthly_mrr` AS
 
-WITH month_spine AS (
-    SELECT month_start
-    FROM UNNEST(
-        GENERATE_DATE_ARRAY(
-            DATE_TRUNC(
-                (SELECT DATE(MIN(created_at)) FROM `{PROJECT}.{DATASET}.subscriptions`),
-                MONTH
-            ),
-            DATE_TRUNC(CURRENT_DATE(), MONTH),
-            INTERVAL 1 MONTH
-        )
-    ) AS month_start
-),
-
-subscription_windows AS (
+WITH subscription_windows AS (
     SELECT
         subscription_id,
         customer_id,
@@ -43,13 +29,17 @@ subscription_windows AS (
 )
 
 SELECT
-    FORMAT_DATE('%Y-%m', m.month_start) AS month,
-    COUNT(DISTINCT s.subscription_id) AS active_subscriptions,
-    COUNT(DISTINCT s.customer_id) AS active_customers,
+    FORMAT_DATE('%Y-%m', month_start) AS month,
+    APPROX_COUNT_DISTINCT(s.subscription_id) AS active_subscriptions,
+    APPROX_COUNT_DISTINCT(s.customer_id) AS active_customers,
     ROUND(SUM(s.monthly_amount_cents) / 100.0, 2) AS mrr_amount
-FROM month_spine m
-CROSS JOIN subscription_windows s
-WHERE s.start_date <= DATE_ADD(m.month_start, INTERVAL 1 MONTH)
-  AND (s.end_date IS NULL OR s.end_date >= m.month_start)
-GROUP BY m.month_start
-ORDER BY m.month_start;
+FROM subscription_windows s,
+UNNEST(
+    GENERATE_DATE_ARRAY(
+        DATE_TRUNC(s.start_date, MONTH),
+        DATE_TRUNC(LEAST(COALESCE(s.end_date, CURRENT_DATE()), CURRENT_DATE()), MONTH),
+        INTERVAL 1 MONTH
+    )
+) AS month_start
+GROUP BY month_start
+ORDER BY month_start;
@@ -11,28 +11,11 @@
 -- =============================================================================
 
 -- ---------------------------------------------------------------------------
--- 1. Generate a month spine covering our data range
--- ---------------------------------------------------------------------------
-WITH month_spine AS (
-    SELECT month_start
-    FROM UNNEST(
-        GENERATE_DATE_ARRAY(
-            DATE_TRUNC(
-                (SELECT DATE(MIN(created_at)) FROM `{PROJECT}.{DATASET}.subscriptions`),
-                MONTH
-            ),
-            DATE_TRUNC(CURRENT_DATE(), MONTH),
-            INTERVAL 1 MONTH
-        )
-    ) AS month_start
-),
-
--- ---------------------------------------------------------------------------
--- 2. Determine each subscription's active window
+-- 1. Determine each subscription's active window
 --    A subscription contributes to MRR for any month where it was active
 --    at some point during that month.
 -- ---------------------------------------------------------------------------
-subscription_windows AS (
+WITH subscription_windows AS (
     SELECT
         subscription_id,
         customer_id,
@@ -72,29 +55,34 @@ subscription_windows AS (
 ),
 
 -- ---------------------------------------------------------------------------
--- 3. Join subscriptions × months to figure out which subs were active each month
+-- 2. Expand each subscription into the months it was active
+--    Only the months inside a subscription's own window are generated,
+--    rather than joining every subscription against every month.
 -- ---------------------------------------------------------------------------
 mrr_by_sub_month AS (
     SELECT
-        m.month_start,
+        month_start,
         s.subscription_id,
         s.customer_id,
         s.monthly_amount_cents,
         s.status,
         s.plan_interval
-    FROM month_spine m
-    CROSS JOIN subscription_windows s
-    WHERE
-        -- Subscription started on or before the end of this month
-        s.start_date <= DATE_ADD(m.month_start, INTERVAL 1 MONTH)
-        -- Subscription hadn't ended before this month started
-        AND (s.end_date IS NULL OR s.end_date >= m.month_start)
-        -- Exclude trialing subs that haven't converted (no revenue yet)
-        AND s.status != 'trialing'
+    FROM subscription_windows s,
+    UNNEST(
+        GENERATE_DATE_ARRAY(
+            -- From the month the subscription started...
+            DATE_TRUNC(s.start_date, MONTH),
+            -- ...through the month it ended (or the current month if still active)
+            DATE_TRUNC(LEAST(COALESCE(s.end_date, CURRENT_DATE()), CURRENT_DATE()), MONTH),
+            INTERVAL 1 MONTH
+        )
+    ) AS month_start
+    -- Exclude trialing subs that haven't converted (no revenue yet)
+    WHERE s.status != 'trialing'
 ),
 
 -- ---------------------------------------------------------------------------
--- 4. Aggregate to monthly MRR
+-- 3. Aggregate to monthly MRR
 -- ---------------------------------------------------------------------------
 monthly_mrr AS (
     SELECT
@@ -108,7 +96,7 @@ monthly_mrr AS (
 )
 
 -- ---------------------------------------------------------------------------
--- 5. Final output with MoM change
+-- 4. Final output with MoM change
 -- ---------------------------------------------------------------------------
 SELECT
     FORMAT_DATE('%Y-%m', month) AS month,